@@ -1,12 +1,21 @@
 # -*- coding: utf-8 -*-
 import os
+import gzip
+import hashlib
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 import time
 import sys
 import io
+import itertools
+import mmap
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Iterable, Iterator
 
 # 设置标准输出编码为utf-8
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
@@ -16,23 +25,37 @@ PARATRANZ_API = "https://paratranz.cn/api"
 PROJECT_ID = os.getenv("PARATRANZ_PROJECT_ID")
 API_KEY = os.getenv("PARATRANZ_API_KEY")
 MAX_RETRIES = 3  # 最大重试次数
-RETRY_DELAY = 5  # 重试延迟时间（秒）
+RETRY_BACKOFF_FACTOR = 0.5  # 指数退避系数（秒）
+RETRY_BACKOFF_JITTER = 0.5  # 退避时间的随机抖动上限（秒）
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)  # 需要重试的状态码
 REQUEST_TIMEOUT = 30  # 请求超时时间（秒）
+MAX_WORKERS = 20  # 并发请求的最大线程数
+UPLOAD_WORKERS = 8  # 并发上传的最大线程数
+GZIP_LEVEL = 6  # 上传请求体的gzip压缩级别
+RATE_LIMIT = 50  # 每个限流周期内允许的最大分页请求数（不含历史记录请求）
+RATE_PERIOD = 60  # 限流周期（秒），与Paratranz按分钟计的限额一致
 
 # 文件路径
 TERMS_DIR = Path(__file__).resolve().parent.parent.parent
 TERMS_FILE = TERMS_DIR / "terms-13798.json"
 LOG_FILE = TERMS_DIR / "logs/sync_terms.log"  # 简化日志路径
+# 同步缓存目录不纳入版本控制（见.gitignore），CI中需用actions/cache等在运行间保留该目录，
+# 否则每次运行都从空缓存开始，仍能正常同步，只是无法跳过未变化的分页和历史记录
+CACHE_DIR = TERMS_DIR / ".github/cache"
+HISTORY_CACHE_FILE = CACHE_DIR / "history.ndjson"  # 历史记录同步缓存（追加写入）
+PAGE_CACHE_FILE = CACHE_DIR / "pages.json"  # 远程术语分页缓存
+PAGE_CACHE_ENABLED = not os.getenv("REQUEST_CACHE_DISABLE")  # 设置REQUEST_CACHE_DISABLE可禁用分页缓存
+LOCAL_FIELDS = ('history', 'last_modified', 'current_version')  # 只在本地维护的术语字段
+
+# 导入时一次性创建所需目录，运行时无需再检查
+for directory in (TERMS_DIR, LOG_FILE.parent, CACHE_DIR):
+    directory.mkdir(parents=True, exist_ok=True)
 
 def setup_logging():
     """配置日志记录"""
     try:
-        # 确保日志目录存在
-        if not LOG_FILE.parent.exists():
-            LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
-        
-        # 在Windows上需要显式设置文件模式
-        sys.stdout = sys.stderr = open(LOG_FILE, "a", encoding="utf-8", mode="w")
+        # 只打开一次日志文件，使用较大的缓冲区减少写入次数
+        sys.stdout = sys.stderr = open(LOG_FILE, "a", encoding="utf-8", buffering=64 * 1024)
         
         # 打印环境信息用于调试
         print("=" * 40)
@@ -45,111 +68,192 @@ def setup_logging():
         # 如果日志文件无法创建，回退到标准输出
         print(f"无法创建日志文件: {str(e)}", file=sys.__stderr__)
 
-def log_error(message: str, error: Exception = None):
+def log_error(message: str, error: Exception = None, detail: Dict[str, Any] = None):
     """记录错误日志"""
     error_detail = {
         "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
         "message": message,
         "error": str(error) if error else None
     }
+    if detail:
+        error_detail["detail"] = detail
+    # 写入日志文件时使用单行紧凑格式，仅在终端中输出时才缩进排版
+    output = orjson.dumps(error_detail, option=orjson.OPT_INDENT_2 if sys.stdout.isatty() else 0)
     try:
-        print(json.dumps(error_detail, ensure_ascii=False, indent=2))
+        print(output.decode("utf-8"))
     except UnicodeEncodeError:
-        # 如果标准输出无法处理unicode字符，使用替代方案
-        with open(sys.__stdout__.buffer, 'w', encoding='utf-8') as f:
-            f.write(json.dumps(error_detail, ensure_ascii=False, indent=2))
-
-def make_request(method: str, url: str, **kwargs) -> requests.Response:
-    """带重试机制的请求函数"""
-    if not API_KEY:
-        raise ValueError("缺少API_KEY环境变量")
-        
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Accept": "application/json",
-        "Content-Type": "application/json"
-    }
-    
-    # 在Windows上需要显式设置代理
-    proxies = {}
-    if os.name == 'nt':
-        http_proxy = os.getenv('HTTP_PROXY') or os.getenv('http_proxy')
-        https_proxy = os.getenv('HTTPS_PROXY') or os.getenv('https_proxy')
-        if http_proxy:
-            proxies['http'] = http_proxy
-        if https_proxy:
-            proxies['https'] = https_proxy
+        # 如果标准输出无法处理unicode字符，直接写入原始字节
+        sys.__stdout__.buffer.write(output + b"\n")
+
+class RateLimiter:
+    """令牌桶限流器，允许短时突发请求，仅在令牌耗尽时等待"""
+
+    def __init__(self, rate: int, period: float):
+        self.capacity = rate
+        self.tokens = float(rate)
+        self.fill_rate = rate / period
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """获取一个令牌，令牌不足时阻塞等待"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+            self.updated = now
+            # 预占令牌，令牌为负时按欠缺量计算等待时间
+            self.tokens -= 1
+            wait = -self.tokens / self.fill_rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+rate_limiter = RateLimiter(RATE_LIMIT, RATE_PERIOD)
+
+# 指数退避加随机抖动重试，429时遵循服务器返回的Retry-After
+retry = Retry(
+    total=MAX_RETRIES,
+    backoff_factor=RETRY_BACKOFF_FACTOR,
+    backoff_jitter=RETRY_BACKOFF_JITTER,
+    status_forcelist=RETRY_STATUS_CODES,
+    allowed_methods=("GET", "POST"),
+    respect_retry_after_header=True,
+    raise_on_status=False  # 重试耗尽后返回最后的响应，由raise_for_status报告错误
+)
+
+# 所有请求共用一个会话，复用已建立的连接，连接池大小与并发线程数一致
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS, max_retries=retry)
+session.mount("https://", adapter)
+session.mount("http://", adapter)
+session.headers.update({
+    "Authorization": f"Bearer {API_KEY}",
+    "Accept": "application/json",
+    "Content-Type": "application/json"
+})
+
+# 代理由requests从HTTP_PROXY/HTTPS_PROXY环境变量读取（trust_env），无需单独设置
+
+def make_request(method: str, url: str, handled_status_codes: Iterable[int] = (), rate_limited: bool = True, **kwargs) -> requests.Response:
+    """带重试机制的请求函数，重试由会话的Retry策略处理
     
-    for attempt in range(MAX_RETRIES):
-        try:
-            response = requests.request(
-                method,
-                url,
-                headers=headers,
-                timeout=REQUEST_TIMEOUT,
-                **kwargs
-            )
-            response.raise_for_status()
-            return response
-        except requests.exceptions.RequestException as e:
-            # 处理429频率限制错误
-            if isinstance(e, requests.exceptions.HTTPError) and e.response.status_code == 429:
-                retry_after = int(e.response.headers.get('Retry-After', RETRY_DELAY))
-                log_error(f"达到API频率限制，将在{retry_after}秒后重试", e)
-                time.sleep(retry_after)
-                continue
-                
-            if attempt < MAX_RETRIES - 1:
-                log_error(f"请求失败，第{attempt + 1}次重试", e)
-                time.sleep(RETRY_DELAY)
-            else:
-                # 记录详细错误信息
-                error_detail = {
-                    "url": url,
-                    "method": method,
-                    "status_code": getattr(e.response, 'status_code', None),
-                    "headers": dict(getattr(e.response, 'headers', {})),
-                    "response": getattr(e.response, 'text', None)
+    handled_status_codes中的状态码由调用方处理，失败时不记录错误日志
+    rate_limited为False时不经过限流器，请求并发数仅受线程池大小限制
+    """
+    try:
+        if rate_limited:
+            rate_limiter.acquire()
+        response = session.request(
+            method,
+            url,
+            timeout=REQUEST_TIMEOUT,
+            **kwargs
+        )
+        response.raise_for_status()
+        return response
+    except requests.exceptions.RequestException as e:
+        if getattr(e.response, 'status_code', None) in handled_status_codes:
+            raise
+        
+        # 记录详细错误信息
+        error_detail = {
+            "url": url,
+            "method": method,
+            "status_code": getattr(e.response, 'status_code', None),
+            "headers": dict(getattr(e.response, 'headers', None) or {}),
+            "response": getattr(e.response, 'text', None)
+        }
+        log_error("请求最终失败", e, error_detail)
+        raise
+
+# 需要记录版本对比信息的操作类型
+DIFF_ACTIONS = frozenset(('update', 'create'))
+
+@dataclass(slots=True)
+class HistoryRow:
+    """术语历史记录，序列化时才展开为嵌套的变更和对比信息"""
+    version: int
+    created_at: str
+    user: str
+    action: str
+    translation: Optional[str]
+    context: Optional[str]
+    old_translation: Optional[str]
+    old_context: Optional[str]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为保存到术语表中的历史记录格式"""
+        # 前后内容全部为空时没有可对比的信息，不构建对比结构
+        has_diff = self.action in DIFF_ACTIONS and (
+            self.translation is not None or self.context is not None
+            or self.old_translation is not None or self.old_context is not None
+        )
+        return {
+            'version': self.version,
+            'created_at': self.created_at,
+            'user': self.user,
+            'action': self.action,
+            'changes': {
+                'translation': self.translation,
+                'context': self.context
+            },
+            # 添加版本对比信息
+            'diff': {
+                'translation': {
+                    'old': self.old_translation,
+                    'new': self.translation
+                },
+                'context': {
+                    'old': self.old_context,
+                    'new': self.context
                 }
-                log_error(f"请求最终失败，错误详情: {json.dumps(error_detail, ensure_ascii=False)}", e)
-                raise
+            } if has_diff else None
+        }
+
+def dumps_default(obj: Any) -> Any:
+    """orjson序列化回调，处理历史记录对象"""
+    if isinstance(obj, HistoryRow):
+        return obj.to_dict()
+    raise TypeError(f"无法序列化类型: {type(obj).__name__}")
+
+def term_fingerprint(term: Dict[str, Any]) -> bytes:
+    """计算术语内容摘要，用于判断术语是否变化，忽略只在本地维护的字段"""
+    term = {key: value for key, value in term.items() if key not in LOCAL_FIELDS}
+    data = orjson.dumps(term, default=dumps_default, option=orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATACLASS)
+    return hashlib.blake2b(data, digest_size=16).digest()
 
 def get_term_history(term_id: int, search_query: str = None) -> List[Dict[str, Any]]:
     """获取术语历史记录"""
     url = f"{PARATRANZ_API}/projects/{PROJECT_ID}/terms/{term_id}/history"
     try:
-        response = make_request("GET", url)
-        history = response.json()
+        # 历史记录请求数随术语数增长，只受MAX_WORKERS并发限制，不占用分页请求的限流额度
+        response = make_request("GET", url, rate_limited=False)
+        history = orjson.loads(response.content)
         
         # 添加变更前后内容
-        for i in range(len(history)):
-            if i > 0:
-                history[i]['old_translation'] = history[i-1].get('translation')
-                history[i]['old_context'] = history[i-1].get('context')
-            else:
-                history[i]['old_translation'] = None
-                history[i]['old_context'] = None
-                
-            # 添加搜索关键词
-            history[i]['search_keywords'] = [
-                history[i].get('user', {}).get('username'),
-                history[i].get('action'),
-                history[i].get('translation'),
-                history[i].get('context'),
-                history[i].get('old_translation'),
-                history[i].get('old_context')
-            ]
+        prev = None
+        for h in history:
+            h['old_translation'] = prev.get('translation') if prev else None
+            h['old_context'] = prev.get('context') if prev else None
+            prev = h
         
-        # 过滤搜索结果
+        # 过滤搜索结果，仅在搜索时按需提取关键词
         if search_query:
             search_query = search_query.lower()
+            # 关键词以换行拼接后统一转小写，每条记录只做一次子串查找且不会跨关键词匹配
             history = [
                 h for h in history
-                if any(
-                    search_query in str(keyword).lower()
-                    for keyword in h['search_keywords']
+                if search_query in "\n".join(
+                    str(keyword)
+                    for keyword in (
+                        h.get('user', {}).get('username'),
+                        h.get('action'),
+                        h.get('translation'),
+                        h.get('context'),
+                        h.get('old_translation'),
+                        h.get('old_context')
+                    )
                     if keyword is not None
-                )
+                ).lower()
             ]
                 
         return history
@@ -157,40 +261,134 @@ def get_term_history(term_id: int, search_query: str = None) -> List[Dict[str, A
         log_error(f"获取术语{term_id}历史记录失败", e)
         return []
 
+def load_page_cache() -> Dict[str, Dict[str, Any]]:
+    """加载远程术语分页缓存，记录每页的ETag和内容"""
+    if not PAGE_CACHE_FILE.exists():
+        return {}
+    try:
+        with open(PAGE_CACHE_FILE, "rb") as f:
+            return orjson.loads(f.read())
+    except Exception as e:
+        # 缓存损坏时重新下载全部分页即可，不影响同步
+        log_error("加载分页缓存失败", e)
+        return {}
+
+def save_page_cache(cache: Dict[str, Dict[str, Any]]):
+    """保存远程术语分页缓存"""
+    try:
+        with open(PAGE_CACHE_FILE, "wb") as f:
+            f.write(orjson.dumps(cache))
+    except Exception as e:
+        log_error("保存分页缓存失败", e)
+
+def get_remote_terms_page(url: str, page: int, page_size: int, page_cache: Dict[str, Dict[str, Any]] = None) -> Dict[str, Any]:
+    """获取单页远程术语，提供分页缓存时使用条件请求"""
+    params = {
+        "page": page,
+        "pageSize": page_size,  # 使用API文档中的标准参数名
+        "includeVariants": True,  # 包含术语变体
+        "includeCaseSensitive": True  # 包含大小写敏感信息
+    }
+    cache_key = f"{page}:{page_size}"
+    cached = page_cache.get(cache_key) if page_cache is not None else None
+    headers = {"If-None-Match": cached['etag']} if cached else None
+    
+    response = make_request("GET", url, params=params, headers=headers)
+    # 内容未变化时直接使用缓存
+    if response.status_code == 304 and cached:
+        return cached['data']
+    
+    data = orjson.loads(response.content)
+    
+    if not isinstance(data, dict) or 'results' not in data:
+        raise ValueError("远程术语表格式错误")
+    
+    etag = response.headers.get("ETag")
+    if page_cache is not None and etag:
+        page_cache[cache_key] = {"etag": etag, "data": data}
+    
+    return data
+
 def get_remote_terms() -> List[Dict[str, Any]]:
     """获取远程术语表"""
     url = f"{PARATRANZ_API}/projects/{PROJECT_ID}/terms"
-    all_terms = []
-    page = 1
     page_size = 50  # 使用API推荐的默认分页大小
+    page_cache = load_page_cache() if PAGE_CACHE_ENABLED else None
     
-    while True:
-        try:
-            params = {
-                "page": page,
-                "pageSize": page_size,  # 使用API文档中的标准参数名
-                "includeVariants": True,  # 包含术语变体
-                "includeCaseSensitive": True  # 包含大小写敏感信息
-            }
-            response = make_request("GET", url, params=params)
-            data = response.json()
-            
-            if not isinstance(data, dict) or 'results' not in data:
-                raise ValueError("远程术语表格式错误")
-                
-            all_terms.extend(data['results'])
-            
-            if len(data['results']) < page_size:
-                break
-                
-            page += 1
-            time.sleep(1)  # 避免触发频率限制
-            
-        except Exception as e:
-            log_error("获取远程术语表失败", e)
-            raise
+    try:
+        data = get_remote_terms_page(url, 1, page_size, page_cache)
+        # 复制结果列表，避免追加其他页面时修改缓存内容
+        all_terms = list(data['results'])
+        
+        # 根据服务器返回的总页数确定剩余页面
+        total_pages = data.get('pageCount')
+        if total_pages is None and data.get('rowCount') is not None:
+            total_pages = (data['rowCount'] + page_size - 1) // page_size
+        
+        if total_pages is None:
+            # 服务器未返回总数时退回逐页获取
+            page = 1
+            while len(data['results']) >= page_size:
+                page += 1
+                data = get_remote_terms_page(url, page, page_size, page_cache)
+                all_terms.extend(data['results'])
+            total_pages = page
+        else:
+            # 并发获取剩余页面，按页码顺序合并结果
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                for data in executor.map(
+                    lambda page: get_remote_terms_page(url, page, page_size, page_cache),
+                    range(2, total_pages + 1)
+                ):
+                    all_terms.extend(data['results'])
+        
+        # 合并时会原地修改术语，需在合并前保存缓存；只保留本次获取的页面
+        if page_cache is not None:
+            page_keys = {f"{page}:{page_size}" for page in range(1, total_pages + 1)}
+            save_page_cache({key: entry for key, entry in page_cache.items() if key in page_keys})
+        
+        return all_terms
+    except Exception as e:
+        log_error("获取远程术语表失败", e)
+        raise
 
-    return all_terms
+def chunked(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """按固定大小分块，无需计算切片下标"""
+    iterator = iter(items)
+    return iter(lambda: list(itertools.islice(iterator, size)), [])
+
+# 服务器不接受gzip压缩的请求体时，本次同步后续改为发送未压缩的请求体
+gzip_upload_enabled = True
+
+def upload_terms_page(url: str, page: int, total_pages: int, page_terms: List[Dict[str, Any]]):
+    """上传单页术语，请求体使用gzip压缩"""
+    global gzip_upload_enabled
+    print(f"正在更新第 {page + 1}/{total_pages} 页，共 {len(page_terms)} 条术语")
+    
+    body = orjson.dumps(page_terms, default=dumps_default, option=orjson.OPT_PASSTHROUGH_DATACLASS)
+    response = None
+    if gzip_upload_enabled:
+        try:
+            response = make_request(
+                "POST", url,
+                data=gzip.compress(body, compresslevel=GZIP_LEVEL),
+                headers={"Content-Encoding": "gzip"},
+                handled_status_codes=(415,)
+            )
+        except requests.exceptions.HTTPError as e:
+            # 仅在服务器明确表示不支持该请求体编码时回退
+            if e.response is None or e.response.status_code != 415:
+                raise
+            log_error("服务器不支持gzip压缩的请求体，改为发送未压缩的请求体", e)
+            gzip_upload_enabled = False
+    if response is None:
+        response = make_request("POST", url, data=body)
+    result = orjson.loads(response.content)
+    
+    if not isinstance(result, dict) or 'message' not in result:
+        raise ValueError("API响应格式错误")
+        
+    print(f"第 {page + 1} 页更新成功")
 
 def update_remote_terms(terms: List[Dict[str, Any]]) -> Dict[str, Any]:
     """更新远程术语表"""
@@ -200,21 +398,19 @@ def update_remote_terms(terms: List[Dict[str, Any]]) -> Dict[str, Any]:
         page_size = 100
         total_pages = (len(terms) + page_size - 1) // page_size
         
-        for page in range(total_pages):
-            start = page * page_size
-            end = start + page_size
-            page_terms = terms[start:end]
-            
-            print(f"正在更新第 {page + 1}/{total_pages} 页，共 {len(page_terms)} 条术语")
-            
-            response = make_request("POST", url, json=page_terms)
-            result = response.json()
-            
-            if not isinstance(result, dict) or 'message' not in result:
-                raise ValueError("API响应格式错误")
-                
-            print(f"第 {page + 1} 页更新成功")
-            time.sleep(1)  # 避免触发频率限制
+        # 并发上传各页，任意一页失败时取消尚未开始的上传
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+            futures = [
+                executor.submit(upload_terms_page, url, page, total_pages, page_terms)
+                for page, page_terms in enumerate(chunked(terms, page_size))
+            ]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
             
         return {"message": "所有术语更新成功"}
         
@@ -222,95 +418,199 @@ def update_remote_terms(terms: List[Dict[str, Any]]) -> Dict[str, Any]:
         log_error("更新远程术语表失败", e)
         raise
 
-def load_local_terms() -> List[Dict[str, Any]]:
-    """加载本地术语表"""
+# 最近一次加载或保存的本地术语表内容摘要，用于保存时判断内容是否变化
+local_terms_digest = None
+
+def load_local_terms() -> Dict[int, Dict[str, Any]]:
+    """加载本地术语表，返回以术语ID为键的字典"""
+    global local_terms_digest
+    local_terms_digest = None
     if not TERMS_FILE.exists():
-        return []
+        return {}
     try:
-        with open(TERMS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        # 通过内存映射读取文件，避免额外复制一份文件内容
+        with open(TERMS_FILE, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mm) as buf:
+                terms = orjson.loads(buf)
+                local_terms_digest = hashlib.blake2b(buf, digest_size=16).digest()
+        
+        # 构建字典时统一将旧字段term_id规范为id
+        local_dict = {}
+        for term in terms:
+            if 'id' not in term:
+                term['id'] = term.pop('term_id', None)
+            local_dict[term['id']] = term
+        return local_dict
     except Exception as e:
         log_error("加载本地术语表失败", e)
         raise
 
-def save_local_terms(terms: List[Dict[str, Any]]):
-    """保存本地术语表"""
+def save_local_terms(terms: List[Dict[str, Any]]) -> bool:
+    """保存本地术语表，内容未变化时跳过写入并返回False"""
+    global local_terms_digest
     try:
-        TERMS_DIR.mkdir(exist_ok=True)
-        with open(TERMS_FILE, "w", encoding="utf-8") as f:
-            json.dump(terms, f, ensure_ascii=False, indent=2)
+        data = orjson.dumps(terms, default=dumps_default, option=orjson.OPT_INDENT_2 | orjson.OPT_PASSTHROUGH_DATACLASS)
+        
+        # 与加载时的文件内容摘要比较，无需重新读取文件
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        if digest == local_terms_digest:
+            return False
+        
+        # 先写入临时文件再替换，避免写入中断损坏术语表
+        tmp_file = TERMS_FILE.with_name(TERMS_FILE.name + ".tmp")
+        with open(tmp_file, "wb") as f:
+            f.write(data)
+            # 确保内容落盘后再替换，防止替换后文件内容为空
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, TERMS_FILE)
+        local_terms_digest = digest
+        return True
     except Exception as e:
         log_error("保存本地术语表失败", e)
         raise
 
-def merge_terms(local_terms: List[Dict[str, Any]], remote_terms: List[Dict[str, Any]], search_query: str = None) -> List[Dict[str, Any]]:
-    """合并本地和远程术语表"""
+def load_history_cache() -> Dict[int, str]:
+    """加载历史记录缓存，记录每个术语上次获取历史记录时的更新时间"""
+    if not HISTORY_CACHE_FILE.exists():
+        return {}
     try:
-        local_dict = {term.get('id', term.get('term_id')): term for term in local_terms}
-        remote_dict = {term['id']: term for term in remote_terms}
-        merged_dict = {**local_dict, **remote_dict}
+        cache = {}
+        line_count = 0
+        with open(HISTORY_CACHE_FILE, "rb") as f:
+            # 每行一条记录，同一术语以最后追加的记录为准
+            for line in f:
+                line_count += 1
+                try:
+                    entry = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    # 跳过中断写入留下的不完整行
+                    continue
+                cache[entry['id']] = entry['updatedAt']
+        
+        # 追加写入会使文件不断增长，过期记录超过一半时重写为每个术语一行
+        if line_count > 2 * len(cache):
+            compact_history_cache(cache)
+        return cache
+    except Exception as e:
+        # 缓存损坏时重新获取全部历史记录即可，不影响同步
+        log_error("加载历史记录缓存失败", e)
+        return {}
+
+def compact_history_cache(cache: Dict[int, str]):
+    """重写历史记录缓存，去除已被覆盖的记录"""
+    try:
+        tmp_file = HISTORY_CACHE_FILE.with_name(HISTORY_CACHE_FILE.name + ".tmp")
+        with open(tmp_file, "wb") as f:
+            f.write(b"".join(
+                orjson.dumps({'id': term_id, 'updatedAt': updated_at}) + b"\n"
+                for term_id, updated_at in cache.items()
+            ))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, HISTORY_CACHE_FILE)
+    except Exception as e:
+        # 压缩失败时保留原文件，下次加载时再尝试
+        log_error("压缩历史记录缓存失败", e)
+
+def save_history_cache(updates: Dict[int, str]):
+    """追加保存本次更新的历史记录缓存"""
+    if not updates:
+        return
+    try:
+        with open(HISTORY_CACHE_FILE, "ab") as f:
+            f.write(b"".join(
+                orjson.dumps({'id': term_id, 'updatedAt': updated_at}) + b"\n"
+                for term_id, updated_at in updates.items()
+            ))
+    except Exception as e:
+        log_error("保存历史记录缓存失败", e)
+
+def merge_terms(local_dict: Dict[int, Dict[str, Any]], remote_terms: List[Dict[str, Any]], search_query: str = None,
+                updated_versions: Optional[Dict[int, str]] = None) -> List[Dict[str, Any]]:
+    """合并本地和远程术语表
+    
+    updated_versions不为None时，记录本次成功获取历史记录的术语及其更新时间，
+    由调用方在术语表保存后写入历史记录缓存
+    """
+    try:
+        # 原地合并，避免重新分配整个字典
+        # 远程术语不包含历史记录，保留被覆盖的本地术语的历史记录信息
+        merged_dict = local_dict
+        for term in remote_terms:
+            local_term = merged_dict.get(term['id'])
+            if local_term:
+                for key in LOCAL_FIELDS:
+                    if key in local_term:
+                        term[key] = local_term[key]
+            merged_dict[term['id']] = term
         
         # 缓存历史记录以避免重复请求
         history_cache = {}
         
-        # 预加载所有历史记录
-        term_ids = [term.get('id') for term in merged_dict.values() if term.get('id')]
-        for term_id in term_ids:
-            if term_id not in history_cache:
-                # 获取本地最新历史记录时间
-                local_term = local_dict.get(term_id)
-                last_sync_time = local_term['last_modified'] if local_term and local_term.get('last_modified') else None
+        # 跳过自上次获取历史记录后未更新的术语，搜索时不使用缓存
+        synced_versions = load_history_cache() if search_query is None else {}
+        term_ids = [
+            term_id for term_id, term in merged_dict.items()
+            if term_id and (
+                term.get('updatedAt') is None
+                or synced_versions.get(term_id) != term.get('updatedAt')
+            )
+        ]
+        
+        # 并发预加载所有历史记录
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {
+                executor.submit(get_term_history, term_id, search_query): term_id
+                for term_id in term_ids
+            }
+            for future in as_completed(futures):
+                term_id = futures[future]
+                history = future.result()
+                
+                # 获取失败时返回空列表，仅在成功获取后更新缓存
+                updated_at = merged_dict[term_id].get('updatedAt')
+                if history and updated_versions is not None and search_query is None and updated_at is not None:
+                    updated_versions[term_id] = updated_at
                 
-                # 增量获取历史记录
-                history = get_term_history(term_id, search_query)
+                # 获取本地最新历史记录时间，增量保留历史记录
+                last_sync_time = merged_dict[term_id].get('last_modified')
                 if last_sync_time:
                     history = [h for h in history if h['created_at'] > last_sync_time]
                 
-                # 只存储必要的历史记录信息并添加版本号
+                # 只存储必要的历史记录信息并添加版本号，版本号接续已有的历史记录
                 if history:
+                    base_version = len(merged_dict[term_id].get('history') or [])
                     history_cache[term_id] = [
-                        {
-                            'version': i + 1,  # 添加版本号
-                            'created_at': h['created_at'],
-                            'user': h['user']['username'],
-                            'action': h['action'],
-                            'changes': {
-                                'translation': h.get('translation'),
-                                'context': h.get('context')
-                            },
-                            # 添加版本对比信息
-                            'diff': {
-                                'translation': {
-                                    'old': h.get('old_translation'),
-                                    'new': h.get('translation')
-                                },
-                                'context': {
-                                    'old': h.get('old_context'),
-                                    'new': h.get('context')
-                                }
-                            } if h.get('action') in ['update', 'create'] else None
-                        }
+                        HistoryRow(
+                            version=base_version + i + 1,  # 添加版本号
+                            created_at=h['created_at'],
+                            user=h['user']['username'],
+                            action=h['action'],
+                            translation=h.get('translation'),
+                            context=h.get('context'),
+                            old_translation=h.get('old_translation'),
+                            old_context=h.get('old_context')
+                        )
                         for i, h in enumerate(history)
                     ]
         
         # 批量处理术语历史记录
         for term in merged_dict.values():
-            if 'id' not in term:
-                term['id'] = term.get('term_id')
-                if 'term_id' in term:
-                    del term['term_id']
-            
             # 添加历史记录信息
             if term.get('id'):
                 history = history_cache.get(term['id'], [])
                 if history:
-                    # 合并新旧历史记录
+                    # 合并新旧历史记录，历史记录按时间从旧到新排列，新记录追加在后
                     if term.get('history'):
-                        term['history'] = history + term['history']
+                        term['history'] = term['history'] + history
                     else:
                         term['history'] = history
                     
-                    term['last_modified'] = history[0]['created_at'] if history else None
+                    # 取最新一条记录的时间，下次只保留此后的历史记录
+                    term['last_modified'] = max(row.created_at for row in history)
                     term['current_version'] = len(term['history'])  # 更新当前版本号
                     
         return list(merged_dict.values())
@@ -335,24 +635,44 @@ def sync_terms() -> bool:
         print(f"术语文件路径: {TERMS_FILE}")
         print(f"日志文件路径: {LOG_FILE}")
         
-        # 加载本地术语表
-        local_terms = load_local_terms()
+        # 后台获取远程术语表的同时加载本地术语表，磁盘读取与网络请求互相重叠
+        executor = ThreadPoolExecutor(max_workers=1)
+        remote_future = executor.submit(get_remote_terms)
+        try:
+            local_terms = load_local_terms()
+        except Exception:
+            # 本地加载失败时立即报错，不等待远程请求完成
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
         print(f"加载了 {len(local_terms)} 条本地术语")
-        
-        # 获取远程术语表
-        remote_terms = get_remote_terms()
+        remote_terms = remote_future.result()
+        executor.shutdown()
         print(f"获取了 {len(remote_terms)} 条远程术语")
         
-        # 合并术语表
-        merged_terms = merge_terms(local_terms, remote_terms)
+        # 合并时会原地修改远程术语，先记录远程术语的内容摘要
+        remote_fingerprints = {term['id']: term_fingerprint(term) for term in remote_terms}
+        
+        # 合并术语表，历史记录缓存在术语表保存后再写入
+        updated_versions = {}
+        merged_terms = merge_terms(local_terms, remote_terms, updated_versions=updated_versions)
         print(f"合并后共有 {len(merged_terms)} 条术语")
         
-        # 保存本地术语表
-        save_local_terms(merged_terms)
-        print("本地术语表保存成功")
+        # 只上传新增或内容有变化的术语
+        changed_terms = [
+            term for term in merged_terms
+            if remote_fingerprints.get(term.get('id')) != term_fingerprint(term)
+        ]
+        print(f"需要更新 {len(changed_terms)} 条远程术语")
+        
+        # 先保存本地术语表，保存失败时不更新远程术语表
+        if save_local_terms(merged_terms):
+            print("本地术语表保存成功")
+        else:
+            print("本地术语表无变化，跳过保存")
+        # 历史记录已写入术语表后才标记为已获取
+        save_history_cache(updated_versions)
         
-        # 更新远程术语表
-        update_result = update_remote_terms(merged_terms)
+        update_result = update_remote_terms(changed_terms)
         print(f"远程术语表更新结果: {update_result}")
         
         return True
@@ -367,3 +687,6 @@ def sync_terms() -> bool:
         return False
 
 if __name__ == "__main__":
+    success = sync_terms()
+    sys.stdout.flush()
+    sys.exit(0 if success else 1)